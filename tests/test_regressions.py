@@ -0,0 +1,203 @@
+import json
+import os
+import tempfile
+import unittest
+import torch
+import xand
+from xand.graph import Graph, Node, Data, DataType, DataOrigin, OperationType
+from xand.optimization_passes import peephole
+from xand.optimization_passes.multiply_one import is_one_tensor
+from xand.ops.ops import Add, Matmul
+
+
+def constant(name, value):
+    return {"name": name, "inputs": [], "outputs": [], "is_output": False,
+            "kind": {"kind": "DATA", "type": "CONSTANT", "value": value}}
+
+
+def operation(name, op_name, inputs, is_output=False):
+    return {"name": name, "inputs": inputs, "outputs": [], "is_output": is_output,
+            "kind": {"kind": "OP", "name": op_name, "type": "BINARY", "args": {}}}
+
+
+class CompileTestCase(unittest.TestCase):
+    def compile(self, config, inputs, **kwargs):
+        """Compile a config given as a list of node dicts"""
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(config, f)
+        self.addCleanup(os.unlink, f.name)
+        return xand.compile(f.name, inputs, **kwargs)
+
+
+class MatmulShapeTest(unittest.TestCase):
+    def test_infer_shape_matches_torch(self):
+        matmul = Matmul("matmul", OperationType.BINARY)
+        shape_pairs = [
+            ([1, 2, 2], [2]), ([2], [1, 2, 2]), ([3, 1, 2, 4], [4]), ([4], [2, 4, 3]),
+            ([2, 3], [3]), ([3], [3, 2]), ([3], [3]), ([2, 1, 3, 4], [5, 4, 2]),
+        ]
+        for shape_a, shape_b in shape_pairs:
+            expected = torch.matmul(torch.empty(shape_a, device="meta"), torch.empty(shape_b, device="meta")).shape
+            self.assertEqual(matmul.infer_shape([shape_a, shape_b]), list(expected), (shape_a, shape_b))
+
+
+class MatmulIdentityTest(CompileTestCase):
+    def test_vector_of_ones_is_not_an_identity(self):
+        config = [
+            constant("v_1", [1.0, 1.0]),
+            operation("matmul_2", "matmul", ["input_0", "v_1"]),
+            operation("matmul_3", "matmul", ["matmul_2", "v_1"], is_output=True),
+        ]
+        x = torch.arange(4.0).reshape(1, 2, 2)
+        module = self.compile(config, x)
+        torch.testing.assert_close(module(x), torch.tensor([6.0]))
+
+    def test_identity_check_rejects_scalars_and_vectors(self):
+        for value in (torch.tensor(1.0), torch.ones(2)):
+            for origin in (DataOrigin.OTHER, DataOrigin.ONES):
+                node = Node("ones_1", Data(DataType.CONSTANT, value, origin=origin))
+                self.assertFalse(is_one_tensor(node), (value, origin))
+
+    def test_batch_of_identities_is_removed(self):
+        config = [
+            constant("eye_1", [[[1.0, 0.0], [0.0, 1.0]]] * 2),
+            operation("matmul_2", "matmul", ["eye_1", "input_0"], is_output=True),
+        ]
+        x = torch.randn(2, 2, 3)
+        module = self.compile(config, x)
+        self.assertNotIn("matmul", module.graph.nodes_by_op)
+        torch.testing.assert_close(module(x), x)
+
+
+class ConstantPoolTest(CompileTestCase):
+    def test_pool_only_holds_live_constants(self):
+        # A chain of additions of constants, folded step by step into a single constant
+        config = [constant("c_0", [[1.0, 2.0], [3.0, 4.0]])]
+        previous = "c_0"
+        for i in range(1, 4):
+            config.append(constant(f"c_{10 + i}", [[float(i), 0.0], [0.0, float(i)]]))
+            config.append(operation(f"add_{i}", "add", [previous, f"c_{10 + i}"]))
+            previous = f"add_{i}"
+        config.append(operation("add_9", "add", ["input_0", previous], is_output=True))
+        module = self.compile(config, torch.randn(2, 2))
+        graph = module.graph
+        self.assertTrue(graph.constant_pool)
+        self.assertTrue(all(node in graph.nodes for node in graph.constant_pool.values()))
+        self.assertTrue(all(node in graph.nodes for node in graph.constant_keys))
+
+
+class DataOriginTest(CompileTestCase):
+    def test_identity_given_by_shape_is_removed(self):
+        config = [
+            {"name": "eye_1", "inputs": [], "outputs": [], "is_output": False,
+             "kind": {"kind": "DATA", "type": "CONSTANT", "origin": "EYE", "shape": [2, 3, 3]}},
+            operation("matmul_2", "matmul", ["input_0", "eye_1"], is_output=True),
+        ]
+        x = torch.randn(2, 4, 3)
+        module = self.compile(config, x)
+        self.assertNotIn("matmul", module.graph.nodes_by_op)
+        torch.testing.assert_close(module(x), x)
+
+    def test_transposed_identity_stack_is_not_an_identity(self):
+        config = [
+            {"name": "eye_1", "inputs": [], "outputs": [], "is_output": False,
+             "kind": {"kind": "DATA", "type": "CONSTANT", "origin": "EYE", "shape": [3, 3, 3]}},
+            {"name": "transpose_2", "inputs": ["eye_1"], "outputs": [], "is_output": False,
+             "kind": {"kind": "OP", "name": "transpose", "type": "TENSOR_MANIPULATION", "args": {"dim0": 0, "dim1": 1}}},
+            operation("matmul_3", "matmul", ["input_0", "transpose_2"], is_output=True),
+        ]
+        x = torch.randn(3, 3, 3)
+        module = self.compile(config, x)
+        eye_stack = torch.eye(3).expand(3, 3, 3)
+        torch.testing.assert_close(module(x), torch.matmul(x, eye_stack.transpose(0, 1)))
+
+    def test_zeros_given_by_shape_are_removed(self):
+        config = [
+            {"name": "zeros_1", "inputs": [], "outputs": [], "is_output": False,
+             "kind": {"kind": "DATA", "type": "CONSTANT", "origin": "ZEROS", "shape": [2, 3]}},
+            operation("add_2", "add", ["input_0", "zeros_1"], is_output=True),
+        ]
+        x = torch.randn(2, 3)
+        module = self.compile(config, x)
+        self.assertNotIn("add", module.graph.nodes_by_op)
+        torch.testing.assert_close(module(x), x)
+
+    def test_ones_origin_is_only_an_identity_for_1x1_matrices(self):
+        for shape, removed in (([2, 2], False), ([3, 1, 1], True)):
+            config = [
+                {"name": "ones_1", "inputs": [], "outputs": [], "is_output": False,
+                 "kind": {"kind": "DATA", "type": "CONSTANT", "origin": "ONES", "shape": shape}},
+                operation("matmul_2", "matmul", ["ones_1", "input_0"], is_output=True),
+            ]
+            x = torch.randn(shape[-1], shape[-1]) if not removed else torch.randn(3, 1, 1)
+            module = self.compile(config, x)
+            self.assertEqual("matmul" not in module.graph.nodes_by_op, removed, shape)
+            torch.testing.assert_close(module(x), torch.matmul(torch.ones(shape), x))
+
+    def test_origin_is_validated(self):
+        config = [
+            {"name": "zeros_1", "inputs": [], "outputs": [], "is_output": False,
+             "kind": {"kind": "DATA", "type": "CONSTANT", "origin": "ZEROS", "value": [1.0, 0.0]}},
+            operation("add_2", "add", ["input_0", "zeros_1"], is_output=True),
+        ]
+        with self.assertRaises(ValueError):
+            self.compile(config, torch.randn(2))
+
+
+class LoadConfigTest(CompileTestCase):
+    def test_non_finite_constants_are_parsed(self):
+        config = [
+            constant("c_1", [float("inf"), float("-inf")]),
+            operation("add_2", "add", ["input_0", "c_1"], is_output=True),
+        ]
+        x = torch.randn(2)
+        module = self.compile(config, x)
+        torch.testing.assert_close(module(x), x + torch.tensor([float("inf"), float("-inf")]))
+
+
+class PeepholeTest(unittest.TestCase):
+    def test_rules_are_tried_in_table_order(self):
+        graph = Graph()
+        a = Node("a_1", Data(DataType.CONSTANT, torch.ones(2)))
+        b = Node("b_2", Data(DataType.CONSTANT, torch.ones(2)))
+        add = Node("add_3", Add("add", OperationType.BINARY))
+        for node in (a, b, add):
+            graph.add_node(node)
+        graph.connect(a, add)
+        graph.connect(b, add)
+        graph.add_output_node(add)
+        tried = []
+
+        def record(name):
+            def rule(graph, node):
+                tried.append(name)
+                return None
+            return rule
+
+        peephole(graph, [(None, record("generic")), ("add", record("add"))])
+        self.assertEqual(tried, ["generic", "add"])
+
+
+class ZeroProductTest(CompileTestCase):
+    def test_zeros_keep_the_product_shape(self):
+        config = [
+            constant("z_1", [0.0, 0.0]),
+            operation("matmul_2", "matmul", ["input_0", "z_1"], is_output=True),
+        ]
+        x = torch.randn(1, 2, 2)
+        module = self.compile(config, x, assume_finite=True)
+        self.assertNotIn("matmul", module.graph.nodes_by_op)
+        torch.testing.assert_close(module(x), torch.zeros(1, 2))
+
+    def test_off_by_default(self):
+        config = [
+            constant("z_1", [[0.0, 0.0], [0.0, 0.0]]),
+            operation("matmul_2", "matmul", ["input_0", "z_1"], is_output=True),
+        ]
+        x = torch.tensor([[float("inf"), 1.0], [2.0, 3.0]])
+        module = self.compile(config, x)
+        torch.testing.assert_close(module(x), torch.matmul(x, torch.zeros(2, 2)), equal_nan=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
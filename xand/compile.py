@@ -1,14 +1,37 @@
-from typing import Union, List
+from functools import partial
+from typing import Union, List, Dict, Optional
+import warnings
 import torch
-from .graph import Graph
-from .optimization_passes import sum_identity, matmul_identity, transpose_cancelation, consteval
+import torch.fx
+from .graph import Graph, Node, Data, DataType
+from .optimization_passes import transpose_cancelation, fuse_transpose_into_matmul, dead_code_elimination
+from .optimization_passes import algebraic_simplify, pool_constants
 from .utils import load_config
 
 
+# Number of calls TorchScript's profiling executor needs before it specializes a function
+NUM_PROFILING_RUNS = 2
+
+
 class XandModule():
-    def __init__(self, graph: Graph):
+    def __init__(self, graph: Graph, example_inputs: Optional[List[torch.Tensor]] = None):
         self.graph = graph
+        self._num_inputs = len(graph.input_nodes)
+        # Whole graph compiled into a single TorchScript function
+        with warnings.catch_warnings():
+            # Raised for torch.fx.GraphModule's own attributes, not for anything in the graph
+            warnings.filterwarnings("ignore", message="The TorchScript type system doesn't support instance-level annotations")
+            scripted = torch.jit.script(lower_to_fx(graph))
+        # Freezing inlines the constant buffers, so TorchScript can fold them into the code
+        self._scripted = torch.jit.freeze(scripted.eval())
+        
+        # Run the profiling calls on the example inputs, so the function is
+        # already specialized to their shapes on the first real call
+        if example_inputs is not None:
+            for _ in range(NUM_PROFILING_RUNS):
+                self(*example_inputs)
         
+    @torch.inference_mode()
     def __call__(self, *inputs: torch.Tensor) -> Union[torch.Tensor, List[torch.Tensor]]:
         """
         Make the module callable like a PyTorch module for inference.
@@ -17,37 +40,70 @@ class XandModule():
             *inputs: Input tensors for the graph
             
         Returns:
-            Single output tensor or list of output tensors
+            Single output tensor or list of output tensors, computed in
+            inference mode (without autograd history)
         """
         
         # Validate number of inputs
-        if len(inputs) != len(self.graph.input_nodes):
-            raise ValueError(f"Expected {len(self.graph.input_nodes)} inputs, got {len(inputs)}")
+        if len(inputs) != self._num_inputs:
+            raise ValueError(f"Expected {self._num_inputs} inputs, got {len(inputs)}")
         
-        # Create input dictionary
-        input_dict = {}
-        for i, (node, tensor) in enumerate(zip(self.graph.input_nodes, inputs)):
-            input_dict[node.name] = tensor
+        # Returns a single tensor if there's only one output, otherwise a list
+        return self._scripted(*inputs)
+    
+    
+def lower_to_fx(graph: Graph) -> torch.fx.GraphModule:
+    """
+    Lower a graph into a torch.fx GraphModule.
+    
+    Input nodes become placeholders (in input order), constant data becomes
+    buffers of the module and every operation is emitted through its lower method.
+    
+    Args:
+        graph: Graph to lower
         
-        # Run the graph forward pass
-        outputs = self.graph.forward(input_dict)
+    Returns:
+        GraphModule returning a single tensor for one output, otherwise a list of tensors
+    """
+    root = torch.nn.Module()
+    fx_graph = torch.fx.Graph()
+    
+    # Maps graph nodes to the fx nodes holding their values
+    values: Dict[Node, torch.fx.Node] = {}
+    
+    for node in graph.input_nodes:
+        values[node] = fx_graph.placeholder(node.name)
+    
+    for node in graph.topological_sort():
+        if node in values:
+            continue
         
-        # Return result(s)
-        if len(outputs) == 1:
-            # Return single tensor if there's only one output
-            return next(iter(outputs.values()))
+        if isinstance(node.kind, Data):
+            if node.kind.type == DataType.INPUT:
+                raise ValueError(f"Input node '{node.name}' is not registered as a graph input")
+            
+            # Store data as a buffer, so it is part of the compiled module
+            buffer_name = f"data_{len(values)}"
+            root.register_buffer(buffer_name, node.get_tensor())
+            values[node] = fx_graph.get_attr(buffer_name)
         else:
-            # Return list of tensors in a consistent order
-            return [outputs[node.name] for node in self.graph.output_nodes]
+            values[node] = node.kind.lower(fx_graph, [values[input_node] for input_node in node.inputs])
     
+    outputs = [values[node] for node in graph.output_nodes]
+    fx_graph.output(outputs[0] if len(outputs) == 1 else outputs)
     
-def compile(config_path: str, inputs: Union[torch.Tensor, List[torch.Tensor]]) -> XandModule:
+    return torch.fx.GraphModule(root, fx_graph)
+    
+    
+def compile(config_path: str, inputs: Union[torch.Tensor, List[torch.Tensor]], assume_finite: bool = False) -> XandModule:
     """
     Compile a graph from a configuration file and optimize it.
     
     Args:
         config_path: Path to the graph configuration file
         *inputs: Input tensor(s) for shape inference
+        assume_finite: Allow rewrites that are only exact for finite values,
+            like replacing a matrix multiplication with zeros by zeros
         
     Returns:
         Compiled XandModule ready for inference
@@ -67,18 +123,31 @@ def compile(config_path: str, inputs: Union[torch.Tensor, List[torch.Tensor]]) -
     graph.infer_shapes()
     
     # Run optimization passes
-    graph = optimize(graph)
+    graph = optimize(graph, assume_finite)
     
-    # Compile graph into a module
-    module = XandModule(graph)
+    # Compile graph into a module, specialized to the sample inputs
+    module = XandModule(graph, list(inputs.values()))
     
     return module
 
 
-def optimize(graph: Graph) -> Graph:
-    graph = consteval(graph)
-    graph = sum_identity(graph)
-    graph = matmul_identity(graph)
-    graph = transpose_cancelation(graph)
+def optimize(graph: Graph, assume_finite: bool = False) -> Graph:
+    # Longer transpose chains and duplicate constants are handled by their own passes,
+    # which can expose new opportunities for each other, so keep running them
+    # until none of them changes the graph
+    passes = [pool_constants, partial(algebraic_simplify, assume_finite=assume_finite), transpose_cancelation]
+    
+    changed = True
+    while changed:
+        changed = False
+        for optimization_pass in passes:
+            graph, pass_changed = optimization_pass(graph)
+            changed |= pass_changed
+    
+    # Fusion hides the matmul from the passes above, so it runs last
+    graph, _ = fuse_transpose_into_matmul(graph)
+    
+    # Drop branches that don't reach any output, so they are never computed
+    graph, _ = dead_code_elimination(graph)
     
     return graph
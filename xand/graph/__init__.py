@@ -1,2 +1,2 @@
 from .graph import Graph
-from .node import Node, Data, Operation, DataType, OperationType
\ No newline at end of file
+from .node import Node, Data, Operation, DataType, DataOrigin, OperationType
\ No newline at end of file
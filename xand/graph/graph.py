@@ -1,31 +1,251 @@
 
-from typing import List, Dict, Set
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Dict, Optional, Set, Tuple
 import torch
-from .node import Node, Data
+from .node import Node, Data, DataType, Operation
 
 class Graph:
     def __init__(self):
-        self.nodes: List[Node] = []
-        self.nodes_by_name: Dict[str, List[Node]] = {}  # Maps base names to list of nodes
+        # Node collections are dicts with None values, used as insertion-ordered
+        # sets, so membership tests and removals take constant time
+        self.nodes: Dict[Node, None] = {}
+        self.nodes_by_name: Dict[str, Dict[Node, None]] = {}  # Maps base names to nodes
+        self.nodes_by_op: Dict[str, Dict[Node, None]] = {}  # Maps operation names to nodes
         self.input_nodes: List[Node] = []
-        self.output_nodes: List[Node] = []
+        self._input_by_name: Dict[str, Node] = {}  # Maps input names to input nodes
+        self.output_nodes: List[Node] = []  # In output order, a node can appear more than once
+        self._output_set: Set[Node] = set()  # Nodes in output_nodes, for membership tests
+        # Output replacements not yet applied to output_nodes, only set within batch()
+        self._pending_outputs: Optional[Dict[Node, Node]] = None
+        self._topo_order: Optional[List[Node]] = None  # Cached topological order
+        # Maps (dtype, shape, content hash) to a constant node, so equal constants can be shared
+        self.constant_pool: Dict[Tuple[torch.dtype, Tuple[int, ...], bytes], Node] = {}
+        # Pool keys of the constants hashed so far, so each constant is only hashed once
+        self.constant_keys: Dict[Node, Tuple[torch.dtype, Tuple[int, ...], bytes]] = {}
+        self._num_indices = 0  # Dense node indices handed out so far
         
     def add_node(self, node: Node) -> None:
-        self.nodes.append(node)
-        # Extract base name without ID
-        base_name = node.name.rsplit('_', 1)[0]
-        if base_name not in self.nodes_by_name:
-            self.nodes_by_name[base_name] = []
-        self.nodes_by_name[base_name].append(node)
+        # Give the node a dense index, so traversals can use flat arrays instead of sets
+        node.idx = self._num_indices
+        self._num_indices += 1
+        self.nodes[node] = None
+        self._index_node(node)
+        self._topo_order = None
+
+    def remove_node(self, node: Node) -> None:
+        """Remove a node from the graph, its edges have to be disconnected by the caller"""
+        self.nodes.pop(node, None)
+        self._unindex_node(self.nodes_by_name, node.base_name, node)
+        # Removed constants must not be handed out by, or kept alive by, the constant pool
+        key = self.constant_keys.pop(node, None)
+        if key is not None and self.constant_pool.get(key) is node:
+            del self.constant_pool[key]
+        if isinstance(node.kind, Operation):
+            self._unindex_node(self.nodes_by_op, node.kind.name, node)
+        self._topo_order = None
+
+    def remove_nodes(self, nodes: Iterable[Node]) -> None:
+        """Remove many nodes at once, their edges have to be disconnected by the caller"""
+        for node in nodes:
+            self.remove_node(node)
+
+    def _index_node(self, node: Node) -> None:
+        """Add a node to the nodes_by_name and nodes_by_op lookup tables"""
+        self.nodes_by_name.setdefault(node.base_name, {})[node] = None
+        if isinstance(node.kind, Operation):
+            self.nodes_by_op.setdefault(node.kind.name, {})[node] = None
+
+    @staticmethod
+    def _unindex_node(index: Dict[str, Dict[Node, None]], key: str, node: Node) -> None:
+        """Remove a node from one of the lookup tables, dropping empty entries"""
+        bucket = index.get(key)
+        if bucket is not None and node in bucket:
+            del bucket[node]
+            if not bucket:
+                del index[key]
+
+    def add_input_node(self, node: Node) -> None:
+        """Add a node to the graph and register it as a graph input"""
+        self.add_node(node)
+        self.input_nodes.append(node)
+        self._input_by_name[node.name] = node
+
+    def add_output_node(self, node: Node) -> None:
+        """Register a node as the next graph output"""
+        self._apply_pending_outputs()
+        self.output_nodes.append(node)
+        self._output_set.add(node)
+        self._topo_order = None
+
+    def is_output(self, node: Node) -> bool:
+        """Check if a node is a graph output"""
+        return node in self._output_set
+
+    def replace_output(self, old_node: Node, new_node: Node) -> None:
+        """Replace a graph output with another node, keeping its output positions"""
+        if old_node not in self._output_set:
+            return
+        self._output_set.discard(old_node)
+        self._output_set.add(new_node)
+        if self._pending_outputs is not None:
+            self._pending_outputs[old_node] = new_node
+        else:
+            self.output_nodes = [new_node if node is old_node else node for node in self.output_nodes]
+        self._topo_order = None
+
+    @contextmanager
+    def batch(self) -> Iterator['Graph']:
+        """
+        Batch the rewrites made within the block. Replaced outputs are collected
+        and output_nodes is rebuilt once at the end, instead of once per
+        replacement. is_output stays up to date within the block.
+        """
+        # Nested batches are part of the outermost one
+        if self._pending_outputs is not None:
+            yield self
+            return
+        
+        self._pending_outputs = {}
+        try:
+            yield self
+        finally:
+            self._apply_pending_outputs()
+            self._pending_outputs = None
+
+    def _apply_pending_outputs(self) -> None:
+        """Apply the output replacements collected by batch() to output_nodes"""
+        pending = self._pending_outputs
+        if not pending:
+            return
+        
+        def resolve(node: Node) -> Node:
+            # An output can be replaced several times within a batch
+            while node in pending:
+                node = pending[node]
+            return node
+        
+        self.output_nodes = [resolve(node) for node in self.output_nodes]
+        pending.clear()
         
     def connect(self, from_node: Node, to_node: Node) -> None:
-        from_node.outputs.append(to_node)
+        # Traversals index flat arrays by node.idx, which is only set by add_node
+        if from_node.idx < 0 or to_node.idx < 0:
+            raise ValueError(f"Nodes have to be added to the graph before connecting {from_node.name} to {to_node.name}")
+        from_node.outputs[to_node] = None
         to_node.inputs.append(from_node)
+        self._topo_order = None
+
+    def replace_all_uses(self, old_node: Node, new_node: Node) -> None:
+        """
+        Make every consumer of old_node read new_node instead, keeping operand
+        positions. old_node gets a new, empty consumer set, the old one is left
+        untouched, so callers can still iterate it without copying it first.
+        """
+        for output_node in old_node.outputs:
+            output_node.inputs = [new_node if node is old_node else node for node in output_node.inputs]
+            new_node.outputs[output_node] = None
+        old_node.outputs = {}
+        self._topo_order = None
+
+    def replace_node(self, old_node: Node, new_node: Node) -> None:
+        """
+        Replace old_node by new_node, both as an input of other nodes and as a
+        graph output, then remove old_node along with any of its (transitive)
+        inputs that nothing else uses anymore. Graph inputs and outputs are kept.
+        """
+        self.replace_all_uses(old_node, new_node)
+        self.replace_output(old_node, new_node)
+
+        unused = [old_node]
+        while unused:
+            node = unused.pop()
+            self.remove_node(node)
+            for input_node in node.inputs:
+                input_node.outputs.pop(node, None)
+                if (not input_node.outputs and input_node in self.nodes
+                        and not self.is_output(input_node)
+                        and self._input_by_name.get(input_node.name) is not input_node):
+                    unused.append(input_node)
+
+    def topological_sort(self) -> List[Node]:
+        """Get the nodes needed for computation in topological order"""
+        if self._topo_order is None:
+            # The order starts from the outputs, which have to be current
+            self._apply_pending_outputs()
+            self._topo_order = self._build_topo()
+        return self._topo_order
+
+    def _build_topo(self) -> List[Node]:
+        """
+        Compute a topological order (Kahn's algorithm) of all nodes reachable
+        from the inputs, the outputs, and everything they depend on.
+        """
+        # Collect nodes reachable from the input nodes
+        reachable: List[Node] = []
+        seen = bytearray(self._num_indices)
+        queue = deque(self.input_nodes)
+        while queue:
+            node = queue.popleft()
+            if seen[node.idx]:
+                continue
+            seen[node.idx] = 1
+            reachable.append(node)
+            queue.extend(node.outputs)
+
+        # Add everything those nodes (and the outputs) depend on, e.g. constants
+        needed: List[Node] = []
+        indeg = [-1] * self._num_indices  # -1 marks nodes that aren't needed
+        queue = deque(reachable)
+        queue.extend(self.output_nodes)
+        while queue:
+            node = queue.popleft()
+            if indeg[node.idx] >= 0:
+                continue
+            indeg[node.idx] = len(node.inputs)
+            needed.append(node)
+            queue.extend(node.inputs)
+
+        # Seed with nodes that don't depend on anything
+        queue = deque(node for node in needed if indeg[node.idx] == 0)
+        order: List[Node] = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for output_node in node.outputs:
+                # Skip consumers that aren't needed for computation
+                if indeg[output_node.idx] < 0:
+                    continue
+                # A consumer can use the same node for several operands
+                indeg[output_node.idx] -= output_node.inputs.count(node)
+                if indeg[output_node.idx] == 0:
+                    queue.append(output_node)
+
+        if len(order) != len(needed):
+            raise ValueError("Graph contains a cycle")
+
+        self._tag_constant_pure(order)
+
+        return order
+
+    def _tag_constant_pure(self, order: List[Node]) -> None:
+        """Mark nodes whose tensor only depends on constants or parameters"""
+        for node in order:
+            if isinstance(node.kind, Data):
+                node.is_constant_pure = node.kind.type in (DataType.CONSTANT, DataType.PARAMETER)
+            else:
+                node.is_constant_pure = bool(node.inputs) and all(
+                    input_node.is_constant_pure for input_node in node.inputs
+                )
+                # The graph changed, so a kept tensor might be stale
+                if node.is_constant_pure:
+                    node.clear_tensor()
     
     def clear_tensors(self) -> None:
-        """Clear all stored tensors in the graph"""
+        """Clear all stored tensors in the graph, except for constant subgraphs"""
         for node in self.nodes:
-            node.clear_tensor()
+            if not node.is_constant_pure:
+                node.clear_tensor()
 
     def clear_shapes(self) -> None:
         """Clear all stored shapes in the graph"""
@@ -35,59 +255,37 @@ class Graph:
     def infer_shapes(self) -> None:
         """Infer shapes for all nodes in the graph"""
         
-        # Clear all existing shapes first
-        self.clear_shapes()
-        
-        # Start from input nodes
-        current_nodes = self.input_nodes.copy()
-        
-        # Keep track of nodes we've processed
-        processed: Set[Node] = set()
-        
-        while current_nodes:
-            # Get next node to process
-            node = current_nodes.pop(0)
-            
-            if node in processed:
-                continue
-            
-            # Infer shape for this node
-            node.get_shape()
-            
-            processed.add(node)
-            
-            # add all it's inputs to processed
-            processed.update(node.inputs)
-            
-            # Add outputs to the list for processing
-            current_nodes.extend(node.outputs)
-            
-            
-        # Update nodes list and nodes_by_name to only include processed nodes
-        # As there might be redundant nodes in the graph that we don't need for
+        # Update nodes list and lookup tables to only include visited nodes,
+        # as there might be redundant nodes in the graph that we don't need for
         # computation
-        self.nodes = list(processed)
-        
-        # Rebuild nodes_by_name dictionary
+        order = self.topological_sort()
+        self.nodes = dict.fromkeys(order)
         self.nodes_by_name.clear()
-        for node in self.nodes:
-            base_name = node.name.rsplit('_', 1)[0]
-            if base_name not in self.nodes_by_name:
-                self.nodes_by_name[base_name] = []
-            self.nodes_by_name[base_name].append(node)
+        self.nodes_by_op.clear()
+        
+        # Visit nodes in topological order, so inputs are always inferred first.
+        # Every visited shape is overwritten, so stale shapes don't have to be cleared
+        for node in order:
+            node._compute_shape_assuming_inputs_ready()
+            self._index_node(node)
             
+    @torch.inference_mode()
     def forward(self, inputs: Dict[str, torch.Tensor] = {}) -> Dict[str, torch.Tensor]:
         """
         Perform forward pass through the graph.
+        
+        Runs in inference mode, as the graph is only used for inference and
+        recording autograd history would only cost time and memory.
         """
-        # Clear previous tensors
-        self.clear_tensors()
+        # Tensors from the previous call aren't cleared up front: every node in
+        # the topological order is recomputed before any of its consumers reads
+        # it, except for constant subgraphs, whose tensors stay valid
         
         # Set input tensors if provided
         if inputs:
             for name, tensor in inputs.items():
                 # Find the input node with this name
-                input_node = next((node for node in self.input_nodes if node.name == name), None)
+                input_node = self._input_by_name.get(name)
                 if input_node is None:
                     raise ValueError(f"Input node '{name}' not found")
                 
@@ -99,29 +297,35 @@ class Graph:
         else:
             raise ValueError("No input tensors provided")
         
-        # Start from input nodes
-        current_nodes = self.input_nodes.copy()
+        order = self.topological_sort()
         
-        # Keep track of processed nodes
-        processed: Set[Node] = set()
-
+        # Number of consumers that still have to run before a tensor can be freed
+        remaining = [0] * self._num_indices
+        for node in order:
+            for input_node in node.inputs:
+                remaining[input_node.idx] += 1
+        is_output = bytearray(self._num_indices)
+        for node in self.output_nodes:
+            is_output[node.idx] = 1
         
         # Process nodes in topological order
-        while current_nodes:
-            node = current_nodes.pop(0)
-            
-            if node in processed:
+        for node in order:
+            # Constant subgraphs are only computed once and kept across calls
+            if node.is_constant_pure and node.tensor is not None:
                 continue
             
-            # Calculate tensor for this node
-            node.get_tensor()
-            
-            processed.add(node)
+            node._compute_tensor_assuming_inputs_ready()
             
-            # Add output nodes to the queue
-            current_nodes.extend(node.outputs)
+            # Free intermediate tensors as soon as their last consumer has run,
+            # keeping graph outputs, Data tensors (inputs and constants) and constant subgraphs
+            for input_node in node.inputs:
+                remaining[input_node.idx] -= 1
+                if (remaining[input_node.idx] == 0 and not is_output[input_node.idx]
+                        and not isinstance(input_node.kind, Data)
+                        and not input_node.is_constant_pure):
+                    input_node.tensor = None
             
-                # Collect outputs
+        # Collect outputs
         outputs = {}
         for node in self.output_nodes:
             outputs[node.name] = node.get_tensor()
@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
 from enum import Enum, auto
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Callable, Set, Tuple
 import torch
+import torch.fx
 
 class DataType(Enum):
     CONSTANT = auto()
@@ -9,17 +10,26 @@ class DataType(Enum):
     PARAMETER = auto()
     INPUT = auto()
     
+class DataOrigin(Enum):
+    ZEROS = auto()  # All elements are zero
+    ONES = auto()  # All elements are one
+    EYE = auto()  # Square identity matrix
+    OTHER = auto()  # Unknown, the tensor has to be inspected
+    
 class OperationType(Enum):
     UNARY = auto()
     BINARY = auto()
     TENSOR_MANIPULATION = auto()
     
 class Data:
-    def __init__(self, type: DataType, value: torch.Tensor):
+    def __init__(self, type: DataType, value: torch.Tensor, origin: DataOrigin = DataOrigin.OTHER):
         # dtype not yet supported :(
         self.type = type
         self.value = value
         self.shape = list(value.shape) if value is not None else None
+        # What the producer of the value knows about its contents, so passes can
+        # skip scanning tensors known to be zeros, ones or identity matrices
+        self.origin = origin
 
         
 class Operation(ABC):
@@ -27,6 +37,8 @@ class Operation(ABC):
         self.name = name
         self.type = op_type
         self.args = args
+        # Output shapes already inferred, keyed by input shapes
+        self._shape_cache: Dict[Tuple[Tuple[int, ...], ...], List[int]] = {}
     
     @abstractmethod
     def forward(self, inputs: List[torch.Tensor]) -> torch.Tensor:
@@ -35,45 +47,91 @@ class Operation(ABC):
     @abstractmethod
     def infer_shape(self, input_shapes: List[List[int]]) -> List[int]:
         pass
+    
+    def get_output_shape(self, input_shapes: List[List[int]]) -> List[int]:
+        """Infer the output shape, reusing the result for input shapes seen before"""
+        key = tuple(tuple(shape) for shape in input_shapes)
+        shape = self._shape_cache.get(key)
+        if shape is None:
+            shape = self.infer_shape(input_shapes)
+            self._shape_cache[key] = shape
+        return shape
+    
+    @abstractmethod
+    def lower(self, graph: torch.fx.Graph, inputs: List[torch.fx.Node]) -> torch.fx.Node:
+        """Emit this operation into a torch.fx graph and return the node holding its result"""
+        pass
 
 class Node:
+    # Nodes are compared and hashed by identity, which the graph's dict based
+    # node sets rely on: two nodes with the same name and kind are still different nodes
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+    # Graphs hold many nodes and passes read their fields in tight loops, slots
+    # make nodes smaller and attribute access cheaper. __weakref__ keeps them
+    # usable as keys of the passes' weak caches
+    __slots__ = ('name', 'base_name', 'id', 'idx', 'kind', 'inputs', 'outputs',
+                 'tensor', 'shape', 'is_constant_pure', '__weakref__')
+
     def __init__(self, name: str, kind: Union[Data, Operation]):
-        # Extract ID from name (e.g., 'matmul_9' -> 9)
+        # Extract base name and ID from name (e.g., 'matmul_9' -> 'matmul', 9)
         self.name = name
-        self.id = int(name.split('_')[-1]) if '_' in name else -1
+        head, _, tail = name.rpartition('_')
+        self.base_name = head or name
+        self.id = int(tail) if tail.isdigit() else -1
+        # Dense index assigned by the graph the node is added to
+        self.idx = -1
 
         self.kind = kind
+        # Operands in order, a node used for several operands appears several times
         self.inputs: List[Node] = []
-        self.outputs: List[Node] = []
+        # Consumers of this node, as an insertion-ordered set. Unlike inputs it holds
+        # every consumer once, even if it uses this node for several operands
+        self.outputs: Dict[Node, None] = {}
         self.tensor: Optional[torch.Tensor] = None
         self.shape: Optional[List[int]] = None
+        # True if the tensor only depends on constants, so it can be kept across forward calls
+        self.is_constant_pure = False
         
     def get_tensor(self) -> torch.Tensor:
+        """Get this node's output tensor, computing any missing input tensors first"""
         # If tensor is already computed, return it
         if self.tensor is not None:
             return self.tensor
         
+        # Compute missing tensors in dependency order, without recursion
+        for node in self._missing_dependencies(lambda node: node.tensor is None):
+            node._compute_tensor_assuming_inputs_ready()
+        return self.tensor
+
+    def get_shape(self) -> List[int]:
+        """Get the shape of this node's output tensor"""
+        # If shape is already computed, return it
+        if self.shape is not None:
+            return self.shape
+        
+        # Infer missing shapes in dependency order, without recursion
+        for node in self._missing_dependencies(lambda node: node.shape is None):
+            node._compute_shape_assuming_inputs_ready()
+        return self.shape
+
+    def _compute_tensor_assuming_inputs_ready(self) -> torch.Tensor:
+        """Compute this node's tensor from the already computed tensors of its inputs"""
         # If node is Data kind, get tensor from value
         if isinstance(self.kind, Data):
             self.tensor = self.kind.value
             return self.tensor
         
-        # Node is Operation kind, need to compute forward
+        # Node is Operation kind, compute result using operation's forward method
         if isinstance(self.kind, Operation):
-            # Get input tensors recursively
-            input_tensors = [input_node.get_tensor() for input_node in self.inputs]
-            # Compute result using operation's forward method
+            input_tensors = [input_node.tensor for input_node in self.inputs]
             self.tensor = self.kind.forward(input_tensors)
             return self.tensor
         
         raise ValueError(f"Invalid kind type for node {self.name}")
 
-    def get_shape(self) -> List[int]:
-        """Get the shape of this node's output tensor"""
-        # If shape is already computed, return it
-        if self.shape is not None:
-            return self.shape
-        
+    def _compute_shape_assuming_inputs_ready(self) -> List[int]:
+        """Infer this node's shape from the already inferred shapes of its inputs"""
         # If node is Data kind, get shape from value
         if isinstance(self.kind, Data):
             self.shape = self.kind.shape
@@ -81,16 +139,35 @@ class Node:
                 raise ValueError(f"Data node {self.name} has no shape information")
             return self.shape
         
-        # Node is Operation kind, need to infer shape
+        # Node is Operation kind, infer shape using operation's shape inference method
         if isinstance(self.kind, Operation):
-            # Get input shapes recursively
-            input_shapes = [input_node.get_shape() for input_node in self.inputs]
-            # Infer shape using operation's shape inference method
-            self.shape = self.kind.infer_shape(input_shapes)
+            input_shapes = [input_node.shape for input_node in self.inputs]
+            self.shape = self.kind.get_output_shape(input_shapes)
             return self.shape
         
         raise ValueError(f"Invalid kind type for node {self.name}")
 
+    def _missing_dependencies(self, is_missing: Callable[['Node'], bool]) -> List['Node']:
+        """
+        Collect this node and all of its (transitive) inputs for which
+        is_missing holds, ordered so that every node comes after its inputs.
+        """
+        order: List[Node] = []
+        visited: Set[Node] = set()
+        # Iterative post-order DFS, (node, True) marks a node whose inputs are done
+        stack: List[Tuple[Node, bool]] = [(self, False)]
+        while stack:
+            node, inputs_done = stack.pop()
+            if inputs_done:
+                order.append(node)
+                continue
+            if node in visited or not is_missing(node):
+                continue
+            visited.add(node)
+            stack.append((node, True))
+            stack.extend((input_node, False) for input_node in node.inputs)
+        return order
+
     def clear_tensor(self) -> None:
         """Clear stored tensor to free memory or recompute with new inputs"""
         self.tensor = None
@@ -1 +1 @@
-from .ops import op_map
\ No newline at end of file
+from .ops import op_map, MatmulT
\ No newline at end of file
@@ -1,5 +1,6 @@
 from typing import Dict, Any, List, Tuple, Type, TypeVar
 import torch
+import torch.fx
 from ..graph import Operation, OperationType
 
 class Add(Operation):
@@ -10,11 +11,16 @@ class Add(Operation):
         assert len(tensors) == 2
         return tensors[0] + tensors[1]
     
-    # we assume there is no implicit broadcasting
+    def lower(self, graph: torch.fx.Graph, inputs: List[torch.fx.Node]) -> torch.fx.Node:
+        return graph.call_function(torch.add, (inputs[0], inputs[1]))
+    
     def infer_shape(self, input_shapes: List[List[int]]) -> List[int]:
         assert len(input_shapes) == 2, "Add requires exactly 2 input shapes"
-        assert len(input_shapes[0]) == len(input_shapes[1]), "Add requires inputs of the same shape"
-        return input_shapes[0]
+        # Inputs are broadcast against each other, like in forward
+        try:
+            return list(torch.broadcast_shapes(input_shapes[0], input_shapes[1]))
+        except RuntimeError:
+            raise ValueError(f"Add inputs of shapes {input_shapes[0]} and {input_shapes[1]} can't be broadcast together")
     
     
 class Matmul(Operation):
@@ -25,6 +31,9 @@ class Matmul(Operation):
         assert len(tensors) == 2, "Matmul requires exactly 2 input tensors"
         return torch.matmul(tensors[0], tensors[1])
     
+    def lower(self, graph: torch.fx.Graph, inputs: List[torch.fx.Node]) -> torch.fx.Node:
+        return graph.call_function(torch.matmul, (inputs[0], inputs[1]))
+    
     def infer_shape(self, input_shapes: List[List[int]]) -> List[int]:
         assert len(input_shapes) == 2, "Matmul requires exactly 2 input shapes"
         
@@ -70,34 +79,34 @@ class Matmul(Operation):
             # The last two dimensions work like the matrix-matrix case
             # The batch dimensions will be broadcast
             
+            # A 1-D operand takes part as a matrix: a vector first is a row [1, k],
+            # a vector second a column [k, 1]. That added dimension is dropped from the result
+            contracted_b = shape_b[-2] if len(shape_b) >= 2 else shape_b[0]
+            
             # Check the matrix dimensions
-            if len(shape_a) >= 2 and len(shape_b) >= 2:
-                if shape_a[-1] != shape_b[-2]:
-                    raise ValueError(
-                        f"Incompatible dimensions for batched matmul: {shape_a} and {shape_b}. "
-                        f"Last dimension of first tensor ({shape_a[-1]}) must match second-to-last "
-                        f"dimension of second tensor ({shape_b[-2]})."
-                    )
+            if shape_a[-1] != contracted_b:
+                raise ValueError(
+                    f"Incompatible dimensions for batched matmul: {shape_a} and {shape_b}. "
+                    f"Last dimension of first tensor ({shape_a[-1]}) must match the contracted "
+                    f"dimension of second tensor ({contracted_b})."
+                )
             
-            # Calculate batch dimensions after broadcasting
-            batch_dims_a = shape_a[:-2] if len(shape_a) > 2 else []
-            batch_dims_b = shape_b[:-2] if len(shape_b) > 2 else []
+            # Number of batch dimensions in front of the matrix dimensions
+            batch_rank_a = max(len(shape_a) - 2, 0)
+            batch_rank_b = max(len(shape_b) - 2, 0)
+            max_batch_dims = max(batch_rank_a, batch_rank_b)
             
-            # Calculate output batch shape through broadcasting rules
+            # Calculate output batch shape through broadcasting rules, treating
+            # missing leading batch dimensions of the shorter shape as 1s
             batch_shape = []
-            
-            # Pad shorter batch dims with 1s for broadcasting
-            max_batch_dims = max(len(batch_dims_a), len(batch_dims_b))
-            padded_a = [1] * (max_batch_dims - len(batch_dims_a)) + batch_dims_a
-            padded_b = [1] * (max_batch_dims - len(batch_dims_b)) + batch_dims_b
-            
-            # Apply broadcasting rules
-            for dim_a, dim_b in zip(padded_a, padded_b):
+            for i in range(max_batch_dims):
+                dim_a = shape_a[i - max_batch_dims + batch_rank_a] if i >= max_batch_dims - batch_rank_a else 1
+                dim_b = shape_b[i - max_batch_dims + batch_rank_b] if i >= max_batch_dims - batch_rank_b else 1
+                
+                # Apply broadcasting rules
                 if dim_a == 1:
                     batch_shape.append(dim_b)
-                elif dim_b == 1:
-                    batch_shape.append(dim_a)
-                elif dim_a == dim_b:
+                elif dim_b == 1 or dim_a == dim_b:
                     batch_shape.append(dim_a)
                 else:
                     raise ValueError(
@@ -105,12 +114,39 @@ class Matmul(Operation):
                         f"Cannot broadcast batch dimensions."
                     )
             
-            # Construct final output shape
-            output_shape = batch_shape + [shape_a[-2] if len(shape_a) >= 2 else 1, 
-                                          shape_b[-1] if len(shape_b) >= 2 else 1]
+            # Construct final output shape, without the dimensions added for 1-D operands
+            output_shape = batch_shape
+            if len(shape_a) >= 2:
+                output_shape = output_shape + [shape_a[-2]]
+            if len(shape_b) >= 2:
+                output_shape = output_shape + [shape_b[-1]]
             
             return output_shape
         
+        
+class MatmulT(Matmul):
+    '''Matmul with the second operand transposed over its last two dimensions'''
+    def __init__(self, name: str, op_type: OperationType, args: Dict[str, Any] = {}):
+        super().__init__(name, op_type, args)
+        
+    def forward(self, tensors: List[torch.Tensor]) -> torch.Tensor:
+        assert len(tensors) == 2, "MatmulT requires exactly 2 input tensors"
+        # transpose returns a view, so no intermediate tensor is materialized
+        return torch.matmul(tensors[0], tensors[1].transpose(-1, -2))
+    
+    def lower(self, graph: torch.fx.Graph, inputs: List[torch.fx.Node]) -> torch.fx.Node:
+        transposed = graph.call_function(torch.transpose, (inputs[1], -1, -2))
+        return graph.call_function(torch.matmul, (inputs[0], transposed))
+    
+    def infer_shape(self, input_shapes: List[List[int]]) -> List[int]:
+        assert len(input_shapes) == 2, "MatmulT requires exactly 2 input shapes"
+        
+        shape_b = input_shapes[1]
+        if len(shape_b) < 2:
+            raise ValueError(f"MatmulT requires the second input to have at least 2 dimensions, got {shape_b}")
+        
+        # Same as matmul with the last two dimensions of the second input swapped
+        return super().infer_shape([input_shapes[0], shape_b[:-2] + [shape_b[-1], shape_b[-2]]])
     
     
 class Unsqueeze(Operation):
@@ -123,6 +159,9 @@ class Unsqueeze(Operation):
         assert len(tensors) == 1
         return tensors[0].unsqueeze(dim=self.args["dim"])
     
+    def lower(self, graph: torch.fx.Graph, inputs: List[torch.fx.Node]) -> torch.fx.Node:
+        return graph.call_function(torch.unsqueeze, (inputs[0], self.args["dim"]))
+    
     def infer_shape(self, input_shapes: List[List[int]]) -> List[int]:
         assert len(input_shapes) == 1
         dim = self.args["dim"]
@@ -145,6 +184,9 @@ class Transpose(Operation):
         assert len(tensors) == 1, "Transpose operation requires exactly 1 input tensor"
         return tensors[0].transpose(dim0=self.args["dim0"], dim1=self.args["dim1"])
     
+    def lower(self, graph: torch.fx.Graph, inputs: List[torch.fx.Node]) -> torch.fx.Node:
+        return graph.call_function(torch.transpose, (inputs[0], self.args["dim0"], self.args["dim1"]))
+    
     def infer_shape(self, input_shapes: List[List[int]]) -> List[int]:
         assert len(input_shapes) == 1, "Transpose operation requires exactly 1 input shape"
         
@@ -176,5 +218,6 @@ op_map: Dict[str, Tuple[Type[Operation], OperationType]] = {
     "add": (Add, OperationType.BINARY),
     "unsqueeze": (Unsqueeze, OperationType.TENSOR_MANIPULATION),   
     "matmul": (Matmul, OperationType.BINARY),
+    "matmul_t": (MatmulT, OperationType.BINARY),
     "transpose": (Transpose, OperationType.TENSOR_MANIPULATION)
 }
\ No newline at end of file
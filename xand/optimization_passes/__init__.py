@@ -1,4 +1,9 @@
-from .add_zero import sum_identity
-from .multiply_one import matmul_identity
-from .cancel_transpose import transpose_cancelation
-from .consteval import consteval
\ No newline at end of file
+from .add_zero import sum_identity, add_zero_rule, zero_product_rule, ZERO_PRODUCT_RULES
+from .multiply_one import matmul_identity, matmul_identity_rule
+from .cancel_transpose import transpose_cancelation, transpose_pair_rule
+from .consteval import consteval, constant_folding_rule, pool_constants
+from .fuse_transpose import fuse_transpose_into_matmul
+from .identity_view import identity_view_elimination, identity_view_rule
+from .dead_code import dead_code_elimination
+from .peephole import peephole, Rule
+from .algebraic import algebraic_simplify, ALGEBRAIC_RULES
\ No newline at end of file
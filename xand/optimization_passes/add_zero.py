@@ -1,26 +1,98 @@
 import torch
-from ..graph import Graph, Node, Data, DataType
+from typing import List, Optional, Tuple
+from weakref import WeakKeyDictionary
+from ..graph import Graph, Node, Data, DataType, DataOrigin
+from .peephole import peephole, Rule
+from .consteval import constant_for
 
 
+# Results of is_zero_tensor, constants don't change, so each tensor is only scanned once
+_is_zero_cache: 'WeakKeyDictionary[Node, bool]' = WeakKeyDictionary()
+
+
+@torch.inference_mode()
 def is_zero_tensor(node: Node) -> bool:
     """Check if a node represents a constant zero tensor."""
     if not isinstance(node.kind, Data) or node.kind.type != DataType.CONSTANT:
         return False
     
+    # Tensors known to be zeros don't have to be scanned
+    if node.kind.origin == DataOrigin.ZEROS:
+        return node.kind.value.numel() > 0
+    
+    cached = _is_zero_cache.get(node)
+    if cached is not None:
+        return cached
+    
     tensor = node.get_tensor()
     if tensor is None:
         return False
     
-    # Check if all elements are zero
-    return bool(torch.all(tensor == 0).item())
+    # Empty tensors are never treated as zero, otherwise check if all elements are zero.
+    # torch.any reduces in place, without building a boolean tensor first
+    result = tensor.numel() > 0 and not bool(torch.any(tensor).item())
+    _is_zero_cache[node] = result
+    return result
+
+def add_zero_rule(graph: Graph, add_node: Node) -> Optional[Node]:
+    """Peephole rule replacing an addition with zero by its other operand."""
+    # Check if operation is binary (has exactly 2 inputs)
+    if len(add_node.inputs) != 2:
+        return None
+    
+    # Keep the other operand of a zero input. Zeros can broadcast the other
+    # operand to a bigger shape, so it only replaces the addition if the
+    # shapes match
+    for i, input_node in enumerate(add_node.inputs):
+        other_input = add_node.inputs[1 - i]
+        if is_zero_tensor(input_node) and other_input.get_shape() == add_node.get_shape():
+            return other_input
+    
+    return None
+
+
+def zero_product_rule(graph: Graph, matmul_node: Node) -> Optional[Node]:
+    """
+    Peephole rule replacing a matrix multiplication with a zero operand by a
+    constant of zeros. This is only exact if the other operand is finite, as
+    infinities and NaNs times zero give NaN, so it is only applied on request.
+    """
+    # Check if operation is binary (has exactly 2 inputs)
+    if len(matmul_node.inputs) != 2:
+        return None
+    
+    zero_inputs = [input_node for input_node in matmul_node.inputs if is_zero_tensor(input_node)]
+    if not zero_inputs:
+        return None
+    
+    # The product is zeros of the result's shape, it can be folded or added away
+    # further on. The shape is taken from the operation itself, run on meta
+    # tensors, so it matches what forward would produce
+    with torch.inference_mode():
+        shape = matmul_node.kind.forward([
+            torch.empty(input_node.get_shape(), device="meta") for input_node in matmul_node.inputs
+        ]).shape
+        zeros = torch.zeros(shape, dtype=zero_inputs[0].get_tensor().dtype)
+    return constant_for(graph, matmul_node, zeros, DataOrigin.ZEROS)
+
+
+# Rules that assume finite values, only applied when asked for with assume_finite
+ZERO_PRODUCT_RULES: List[Rule] = [
+    ("matmul", zero_product_rule),
+    ("matmul_t", zero_product_rule),
+]
+
 
-def sum_identity(graph: Graph) -> Graph:
+def sum_identity(graph: Graph, assume_finite: bool = False) -> Tuple[Graph, bool]:
     '''
     Removes unnecessary additions with zero.
     
     This optimization pass looks for addition operations where one of the operands
     is a constant tensor filled with zeros. In such cases, the addition operation
-    is redundant and can be replaced with the non-zero operand.
+    is redundant and can be replaced with the non-zero operand, as long as the
+    zeros don't broadcast it to a different shape. With assume_finite, matrix
+    multiplications with zeros are replaced by zeros first, so sums with their
+    results are removed as well.
     
     Example:
         Input graph:
@@ -32,79 +104,7 @@ def sum_identity(graph: Graph) -> Graph:
             input → output
     '''
     
-    # Continue optimizing until no more changes can be made
-    changes_made = True
-    while changes_made:
-        changes_made = False
-        
-        # Get all add operations
-        if 'add' not in graph.nodes_by_name:
-            break  # No add operations to optimize
-        
-        add_nodes = graph.nodes_by_name['add'].copy()
-        
-        for add_node in add_nodes:
-            # Check if operation is binary (has exactly 2 inputs)
-            if len(add_node.inputs) != 2:
-                continue
-            
-            # Check if any of the inputs are zero constants
-            zero_inputs = []
-            non_zero_inputs = []
-            
-            for input_node in add_node.inputs:
-                if is_zero_tensor(input_node):
-                    zero_inputs.append(input_node)
-                else:
-                    non_zero_inputs.append(input_node)
-
-            # If at least one input is zero, we can optimize
-            if zero_inputs:
-                # Determine which node to keep (non-zero input or first zero input)
-                node_to_keep = non_zero_inputs[0] if non_zero_inputs else zero_inputs[0]
-                nodes_to_remove = [node for node in add_node.inputs if node != node_to_keep]
-                
-                # Check if add_node was an output node
-                was_output = add_node in graph.output_nodes
-                
-                # Redirect all outputs of the add node to use the node we're keeping
-                for output_node in add_node.outputs.copy():
-                    add_node.outputs.remove(output_node)
-                    output_node.inputs.remove(add_node)
-                    graph.connect(node_to_keep, output_node)
-                
-                # If the add node was an output, mark the kept node as output too
-                if was_output and node_to_keep not in graph.output_nodes:
-                    graph.output_nodes.append(node_to_keep)
-                
-                # Remove add node from graph and output_nodes if needed
-                if add_node in graph.output_nodes:
-                    graph.output_nodes.remove(add_node)
-                graph.nodes.remove(add_node)
-                if 'add' in graph.nodes_by_name:
-                    graph.nodes_by_name['add'].remove(add_node)
-                    if not graph.nodes_by_name['add']:
-                        del graph.nodes_by_name['add']
-                
-                # Remove other nodes if they're not used by any other node
-                for node in nodes_to_remove:
-                    # first remove add_node from outputs
-                    if add_node in node.outputs:
-                        node.outputs.remove(add_node)
-                    if not node.outputs:
-                        if node in graph.nodes:
-                            graph.nodes.remove(node)
-                        
-                        # Remove from nodes_by_name
-                        base_name = node.name.rsplit('_', 1)[0]
-                        if base_name in graph.nodes_by_name and node in graph.nodes_by_name[base_name]:
-                            graph.nodes_by_name[base_name].remove(node)
-                            if not graph.nodes_by_name[base_name]:
-                                del graph.nodes_by_name[base_name]
-                
-                # Mark that we made a change and break to restart with fresh node lists
-                changes_made = True
-                break
-    
-    # No need to recalculate output nodes since we maintain them during optimization
-    return graph
\ No newline at end of file
+    rules: List[Rule] = [("add", add_zero_rule)]
+    if assume_finite:
+        rules += ZERO_PRODUCT_RULES
+    return peephole(graph, rules)
\ No newline at end of file
@@ -0,0 +1,44 @@
+from typing import List, Tuple
+from ..graph import Graph
+from .peephole import peephole, Rule
+from .consteval import constant_folding_rule
+from .add_zero import add_zero_rule, ZERO_PRODUCT_RULES
+from .multiply_one import matmul_identity_rule
+from .identity_view import identity_view_rule
+from .cancel_transpose import transpose_pair_rule
+
+# Rules of the algebraic simplifications, constant folding is tried first
+ALGEBRAIC_RULES: List[Rule] = [
+    (None, constant_folding_rule),
+    ("add", add_zero_rule),
+    ("matmul", matmul_identity_rule),
+    ("transpose", identity_view_rule),
+    ("transpose", transpose_pair_rule),
+]
+
+
+def algebraic_simplify(graph: Graph, assume_finite: bool = False) -> Tuple[Graph, bool]:
+    '''
+    Applies constant folding and the algebraic identities in a single walk.
+
+    This optimization pass combines consteval, sum_identity, matmul_identity,
+    identity_view_elimination and the pairwise case of transpose_cancelation.
+    Their rewrites enable each other: folding constants can produce a zero or
+    an identity matrix, and removing transposes can expose an addition with
+    zero. Running them on one worklist reaches the combined result without
+    repeating every pass until nothing changes. With assume_finite, matrix
+    multiplications with zeros are replaced by zeros as well, which changes
+    the result if the other operand holds infinities or NaNs.
+
+    Example:
+        Input graph:
+            input → transpose → transpose → add → output
+                                             ↑
+                                zeros → transpose
+
+        After optimization:
+            input → output
+    '''
+
+    rules = ALGEBRAIC_RULES + ZERO_PRODUCT_RULES if assume_finite else ALGEBRAIC_RULES
+    return peephole(graph, rules)
@@ -1,13 +1,39 @@
-from ..graph import Graph
+from typing import Dict, FrozenSet, Optional, Tuple
+from ..graph import Graph, Node, Operation
 
-def transpose_cancelation(graph: Graph) -> Graph:
+
+def is_transpose(node: Node) -> bool:
+    """Check if a node is a transpose operation."""
+    return isinstance(node.kind, Operation) and node.kind.name == 'transpose'
+
+
+def transpose_dims(node: Node, rank: Optional[int] = None) -> FrozenSet[int]:
+    """Return the pair of dimensions swapped by a transpose node, with negative dimensions normalized."""
+    if rank is None:
+        rank = len(node.inputs[0].get_shape())
+    return frozenset(dim + rank if dim < 0 else dim for dim in (node.kind.args["dim0"], node.kind.args["dim1"]))
+
+
+def transpose_pair_rule(graph: Graph, transpose_node: Node) -> Optional[Node]:
+    """Peephole rule replacing a transpose of a transpose swapping the same dimensions by the original input."""
+    first_transpose = transpose_node.inputs[0]
+    if not is_transpose(first_transpose) or transpose_dims(first_transpose) != transpose_dims(transpose_node):
+        return None
+    return first_transpose.inputs[0]
+
+
+def transpose_cancelation(graph: Graph) -> Tuple[Graph, bool]:
     '''
-    Removes consecutive transpose operations.
+    Removes chains of transpose operations that cancel each other out.
     
-    This optimization pass looks for patterns where two transpose operations
-    are performed consecutively and cancel each other out. In such cases, both
-    transpose operations are eliminated, and the original input is connected
-    directly to the final output.
+    This optimization pass walks the graph once in topological order and
+    tracks, for every transpose, the node its chain of transposes starts
+    from and the permutation the whole chain applies to it. A transpose whose
+    chain adds up to a permutation already computed by an earlier node of the
+    same chain (in particular the identity, computed by the chain's start) is
+    replaced by that node. This catches consecutive pairs as well as longer
+    chains, like (0, 1) → (1, 2) → (0, 1) → (0, 2), where no two neighbours
+    cancel out.
     
     Example:
         Input graph:
@@ -17,91 +43,42 @@ def transpose_cancelation(graph: Graph) -> Graph:
             input → output
     '''
     
-    # Continue optimizing until no more changes can be made
-    changes_made = True
-    while changes_made:
-        changes_made = False
+    changed = False  # Whether any rewrite was made
+    
+    # Maps a transpose to the start of its chain and the permutation applied to it
+    chains: Dict[Node, Tuple[Node, Tuple[int, ...]]] = {}
+    # Maps a chain start and a permutation to the first node computing it
+    computed: Dict[Tuple[Node, Tuple[int, ...]], Node] = {}
+    
+    with graph.batch():
+        # Rewrites drop the cached order instead of changing it, so it can be iterated directly
+        for transpose_node in graph.topological_sort():
+            # Skip other operations and nodes removed by an earlier rewrite
+            if not is_transpose(transpose_node) or transpose_node not in graph.nodes:
+                continue
         
-        # Get all transpose operations
-        if 'transpose' not in graph.nodes_by_name:
-            break  # No transpose operations to optimize
+            input_node = transpose_node.inputs[0]
+            if input_node in chains:
+                start, permutation = chains[input_node]
+            else:
+                # The input starts a new chain, as the identity permutation of itself
+                start, permutation = input_node, tuple(range(len(input_node.get_shape())))
+                computed.setdefault((start, permutation), start)
         
-        transpose_nodes = graph.nodes_by_name['transpose'].copy()
+            # Swapping a dimension with itself leaves the permutation unchanged
+            swapped = list(permutation)
+            dims = sorted(transpose_dims(transpose_node, len(permutation)))
+            swapped[dims[0]], swapped[dims[-1]] = swapped[dims[-1]], swapped[dims[0]]
+            permutation = tuple(swapped)
         
-        for transpose_node in transpose_nodes:
-                
-            # Check all inputs to see if any are also transpose nodes
-            for input_node in transpose_node.inputs:
-                #  input is a transpose node
-                if ('transpose' in graph.nodes_by_name and 
-                    input_node in graph.nodes_by_name['transpose']):
-                    
-                    # We found a consecutive pair of transpose operations
-                    first_transpose = input_node
-                    second_transpose = transpose_node
-                    
-                    # IMPORTANT: Check if the first transpose has exactly one output
-                    # and that output is the second transpose
-                    if len(first_transpose.outputs) != 1 or first_transpose.outputs[0] != second_transpose:
-                        continue  # Skip if this condition isn't met
-                    
-                    # Check if the double transpose preserves the original shape
-                    
-                    # Get the original input shape (input to first transpose)                        
-                    original_input = first_transpose.inputs[0]
-                    original_shape = original_input.get_shape()
-                    
-                    # Get the final output shape (output of second transpose)
-                    final_shape = second_transpose.get_shape()
-                    
-                    # If shapes don't match, these transposes don't cancel out
-                    if original_shape != final_shape:
-                        continue
-
-                    
-                    # Check if second_transpose was an output node
-                    was_output = second_transpose in graph.output_nodes
-                    
-                    # Connect the original input directly to all outputs of the second transpose
-                    for output_node in second_transpose.outputs.copy():
-                        second_transpose.outputs.remove(output_node)
-                        output_node.inputs.remove(second_transpose)
-                        graph.connect(original_input, output_node)
-                        
-                    # Remove the first transpose from the outputs of the original input
-                    if first_transpose in original_input.outputs:
-                        original_input.outputs.remove(first_transpose)
-                    
-                    # If the second transpose was an output, mark the original input as output too
-                    if was_output and original_input not in graph.output_nodes:
-                        graph.output_nodes.append(original_input)
-                    
-                    # Remove both transpose nodes from output_nodes if needed
-                    if first_transpose in graph.output_nodes:
-                        graph.output_nodes.remove(first_transpose)
-                    if second_transpose in graph.output_nodes:
-                        graph.output_nodes.remove(second_transpose)
-                    
-                    # Remove both nodes from the graph
-                    if first_transpose in graph.nodes:
-                        graph.nodes.remove(first_transpose)
-                    if second_transpose in graph.nodes:
-                        graph.nodes.remove(second_transpose)
-                    
-                    # Remove from nodes_by_name
-                    if 'transpose' in graph.nodes_by_name:
-                        if first_transpose in graph.nodes_by_name['transpose']:
-                            graph.nodes_by_name['transpose'].remove(first_transpose)
-                        if second_transpose in graph.nodes_by_name['transpose']:
-                            graph.nodes_by_name['transpose'].remove(second_transpose)
-                        if not graph.nodes_by_name['transpose']:
-                            del graph.nodes_by_name['transpose']
-                    
-                    # Mark that we made a change and break to restart with fresh node lists
-                    changes_made = True
-                    break
-            
-            if changes_made:
-                break
+            # Reuse the node computing the same permutation, unless an earlier
+            # rewrite removed it
+            existing = computed.get((start, permutation))
+            if existing is not None and existing in graph.nodes:
+                graph.replace_node(transpose_node, existing)
+                changed = True
+            else:
+                chains[transpose_node] = (start, permutation)
+                computed[(start, permutation)] = transpose_node
     
-    return graph
\ No newline at end of file
+    return graph, changed
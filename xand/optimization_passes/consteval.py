@@ -1,7 +1,154 @@
-from ..graph import Graph, Node, Data, Operation, DataType
+import hashlib
+from typing import Optional, Tuple
+import torch
+from ..graph import Graph, Node, Data, DataType, DataOrigin, Operation
+from .peephole import peephole
+from .cancel_transpose import transpose_dims
 
 
-def consteval(graph: Graph) -> Graph:
+def constant_key(tensor: torch.Tensor) -> Tuple[torch.dtype, Tuple[int, ...], bytes]:
+    """Key a constant tensor by its dtype, shape and a hash of its raw bytes."""
+    data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8)
+    return tensor.dtype, tuple(tensor.shape), hashlib.sha1(data.numpy()).digest()
+
+
+def pooled_constant(graph: Graph, tensor: torch.Tensor, key: Tuple[torch.dtype, Tuple[int, ...], bytes]) -> Optional[Node]:
+    """Find a constant node in the graph holding exactly the given tensor, whose pool key is key."""
+    pooled = graph.constant_pool.get(key)
+    # Equal hashes are double checked
+    if pooled is None or not torch.equal(pooled.get_tensor(), tensor):
+        return None
+    return pooled
+
+
+def register_constant(graph: Graph, node: Node, key: Tuple[torch.dtype, Tuple[int, ...], bytes]) -> None:
+    """Add a constant node to the graph's constant pool, as the node holding its tensor."""
+    graph.constant_keys[node] = key
+    graph.constant_pool[key] = node
+
+
+def pool_constants(graph: Graph) -> Tuple[Graph, bool]:
+    '''
+    Merges constant nodes holding equal tensors.
+    
+    This optimization pass registers every constant in the graph's constant
+    pool, keyed by dtype, shape and a hash of the tensor's bytes. A constant
+    equal to one already in the pool is replaced by it, so every distinct
+    constant is stored once. Constants that are graph outputs are kept, so
+    every output keeps its own node.
+    
+    Example:
+        Input graph:
+            const_1 → add → output
+                       ↑
+            const_2 (equal to const_1)
+            
+        After optimization:
+            const_1 → add → output
+               └───────↑
+    '''
+    
+    changed = False  # Whether any rewrite was made
+    
+    for node in list(graph.nodes):
+        if node not in graph.nodes or not isinstance(node.kind, Data) or node.kind.type != DataType.CONSTANT:
+            continue
+        
+        # Constants already in the pool were hashed before and have nothing to merge with
+        key = graph.constant_keys.get(node)
+        if key is not None and graph.constant_pool.get(key) is node:
+            continue
+        
+        tensor = node.get_tensor()
+        if key is None:
+            key = constant_key(tensor)
+            graph.constant_keys[node] = key
+        
+        pooled = pooled_constant(graph, tensor, key)
+        if pooled is None:
+            register_constant(graph, node, key)
+        elif not graph.is_output(node):
+            graph.replace_node(node, pooled)
+            changed = True
+    
+    return graph, changed
+
+
+def has_constant_inputs(node: Node) -> bool:
+    """Check if a node is an operation whose inputs are all constant nodes."""
+    return (isinstance(node.kind, Operation) and bool(node.inputs)
+            and all(isinstance(input_node.kind, Data) and input_node.kind.type == DataType.CONSTANT
+                    for input_node in node.inputs))
+
+
+def folded_origin(node: Node) -> DataOrigin:
+    """Derive what is known about an operation's result from the origins of its constant inputs."""
+    origins = [input_node.kind.origin for input_node in node.inputs]
+    
+    # Views keep zeros and ones
+    if node.kind.name in ('transpose', 'unsqueeze') and origins[0] in (DataOrigin.ZEROS, DataOrigin.ONES):
+        return origins[0]
+    
+    # Transposing identity matrices gives them back, but only if the transpose
+    # stays within the matrices. Swapping a batch dimension mixes the stack up
+    if node.kind.name == 'transpose' and origins[0] == DataOrigin.EYE:
+        rank = len(node.inputs[0].get_shape())
+        dims = transpose_dims(node, rank)
+        if rank == 2 or len(dims) == 1 or dims == {rank - 2, rank - 1}:
+            return DataOrigin.EYE
+    
+    # A sum of zeros is zeros
+    if node.kind.name == 'add' and all(origin == DataOrigin.ZEROS for origin in origins):
+        return DataOrigin.ZEROS
+    
+    return DataOrigin.OTHER
+
+
+def constant_folding_rule(graph: Graph, node: Node) -> Optional[Node]:
+    """Peephole rule replacing an operation with constant inputs by a constant holding its result."""
+    if not has_constant_inputs(node):
+        return None
+    
+    # Gather input tensors
+    input_tensors = [input_node.get_tensor() for input_node in node.inputs]
+    
+    # Compute the result without autograd bookkeeping. Results of views, like
+    # transpose, are made contiguous so later reads and hashing stay cheap
+    with torch.inference_mode():
+        result_tensor = node.kind.forward(input_tensors).detach().contiguous()
+    
+    return constant_for(graph, node, result_tensor, folded_origin(node))
+
+
+def constant_for(graph: Graph, node: Node, tensor: torch.Tensor, origin: DataOrigin = DataOrigin.OTHER) -> Node:
+    """Get a constant node holding the known result of node, to replace node with."""
+    # Reuse an equal constant if there is one. Outputs get their own node,
+    # so that every output keeps its own name
+    key = constant_key(tensor)
+    if not graph.is_output(node):
+        pooled = pooled_constant(graph, tensor, key)
+        if pooled is not None:
+            return pooled
+    
+    # Create a new constant node with the computed result
+    const_name = f"{node.base_name}_const_{node.id}"
+    
+    # Create new constant data
+    const_data = Data(type=DataType.CONSTANT, value=tensor, origin=origin)
+    
+    # Create new constant node
+    const_node = Node(name=const_name, kind=const_data)
+    # The shape is known already, later passes shouldn't have to infer it
+    const_node.shape = list(tensor.shape)
+    
+    # Add new node to graph
+    graph.add_node(const_node)
+    register_constant(graph, const_node, key)
+    
+    return const_node
+
+
+def consteval(graph: Graph) -> Tuple[Graph, bool]:
     '''
     Constant Evaluation Optimization Pass
     
@@ -19,93 +166,9 @@ def consteval(graph: Graph) -> Graph:
             computed_const → output
     '''
     
-    # Continue optimizing until no more changes can be made
-    changes_made = True
-    while changes_made:
-        changes_made = False
-        
-        # Check all nodes in the graph
-        for node in list(graph.nodes):  # Create a copy to safely modify during iteration
-            # Skip if not an operation node
-            if not isinstance(node.kind, Operation):
-                continue
-                
-            # Check if all inputs are constant nodes
-            all_inputs_constant = True
-            for input_node in node.inputs:
-                if not isinstance(input_node.kind, Data) or input_node.kind.type != DataType.CONSTANT:
-                    all_inputs_constant = False
-                    break
-            
-            # If all inputs are constants, we can evaluate this operation at compile time
-            if all_inputs_constant and node.inputs:
-                # Gather input tensors
-                input_tensors = [input_node.get_tensor() for input_node in node.inputs]
-                
-                # Compute the result
-                result_tensor = node.kind.forward(input_tensors)
-                
-                # Create a new constant node with the computed result
-                const_name = f"{node.name.split('_')[0]}_const_{node.id}"
-                
-                # Create new constant data
-                const_data = Data(type=DataType.CONSTANT, value=result_tensor)
-                
-                # Create new constant node
-                const_node = Node(name=const_name, kind=const_data)
-                
-                # Add new node to graph
-                graph.add_node(const_node)
-                
-                # Check if the original node was an output node
-                was_output = node in graph.output_nodes
-
-                # If the original node was an output, mark the new constant as output
-                if was_output:
-                    if node in graph.output_nodes:
-                        graph.output_nodes.remove(node)
-                    if const_node not in graph.output_nodes:
-                        graph.output_nodes.append(const_node)
-                
-                # Connect the new constant node to all outputs of the original node
-                for output_node in node.outputs.copy():
-                    # Disconnect from the original node
-                    node.outputs.remove(output_node)
-                    output_node.inputs.remove(node)
-                    
-                    # Connect to the new constant node
-                    graph.connect(const_node, output_node)
-                
-                
-                # Remove the original operation node
-                if node in graph.nodes:
-                    graph.nodes.remove(node)
-                
-                # Remove from nodes_by_name
-                base_name = node.name.rsplit('_', 1)[0]
-                if base_name in graph.nodes_by_name and node in graph.nodes_by_name[base_name]:
-                    graph.nodes_by_name[base_name].remove(node)
-                    if not graph.nodes_by_name[base_name]:
-                        del graph.nodes_by_name[base_name]
-                
-                # Remove input nodes if they're not used by any other nodes
-                for input_node in node.inputs:
-                    input_node.outputs.remove(node)  # Remove connection to the removed node
-                    
-                    if not input_node.outputs:  # If no more outputs, we can remove this node
-                        if input_node in graph.nodes:
-                            graph.nodes.remove(input_node)
-                            
-                        # Remove from nodes_by_name
-                        base_name = input_node.name.rsplit('_', 1)[0]
-                        if base_name in graph.nodes_by_name and input_node in graph.nodes_by_name[base_name]:
-                            graph.nodes_by_name[base_name].remove(input_node)
-                            if not graph.nodes_by_name[base_name]:
-                                del graph.nodes_by_name[base_name]
-                
-                # Mark that we made a change
-                changes_made = True
-                break  # Break to restart with fresh nodes list
-                    
-    
-    return graph
\ No newline at end of file
+    graph, pooled = pool_constants(graph)
+    # Only operations whose inputs are all constant can be folded right away.
+    # Folding one makes its consumers candidates, the peephole walk queues them
+    ready = [node for node in graph.topological_sort() if has_constant_inputs(node)]
+    graph, folded = peephole(graph, [(None, constant_folding_rule)], nodes=ready)
+    return graph, pooled or folded
\ No newline at end of file
@@ -0,0 +1,50 @@
+from collections import deque
+from typing import Tuple
+from ..graph import Graph
+
+
+def dead_code_elimination(graph: Graph) -> Tuple[Graph, bool]:
+    '''
+    Removes nodes that don't contribute to any output.
+
+    This optimization pass walks backwards from the output nodes through
+    their inputs and marks everything it reaches as live. All other nodes
+    are removed from the graph, except for the graph inputs, which are part
+    of the module's signature. Edges from live nodes to removed consumers
+    are pruned as well, so removed branches are never computed.
+
+    Example:
+        Input graph:
+            input → add → output
+              ↓
+            matmul → transpose
+
+        After optimization:
+            input → add → output
+    '''
+
+    # Walk backwards from the outputs to find all live nodes
+    live = set()
+    queue = deque(graph.output_nodes)
+    while queue:
+        node = queue.popleft()
+        if node in live:
+            continue
+        live.add(node)
+        queue.extend(node.inputs)
+
+    # Graph inputs are kept even if unused, as callers still pass them
+    live.update(graph.input_nodes)
+
+    dead_nodes = [node for node in graph.nodes if node not in live]
+    if not dead_nodes:
+        return graph, False
+
+    # Prune edges from live nodes to removed consumers
+    for node in live:
+        if any(output_node not in live for output_node in node.outputs):
+            node.outputs = {output_node: None for output_node in node.outputs if output_node in live}
+
+    graph.remove_nodes(dead_nodes)
+
+    return graph, True
\ No newline at end of file
@@ -0,0 +1,68 @@
+from typing import Tuple
+from ..graph import Graph, Node, OperationType
+from ..ops import MatmulT
+from .cancel_transpose import is_transpose, transpose_dims
+
+
+def is_last_dims_transpose(node: Node) -> bool:
+    """Check if a node is a transpose swapping the last two dimensions of its input."""
+    if not is_transpose(node):
+        return False
+    
+    rank = len(node.inputs[0].get_shape())
+    if rank < 2:
+        return False
+    
+    return transpose_dims(node) == {rank - 2, rank - 1}
+
+
+def fuse_transpose_into_matmul(graph: Graph) -> Tuple[Graph, bool]:
+    '''
+    Folds a transpose of the second matmul operand into the matmul itself.
+    
+    This optimization pass looks for matmul operations whose second operand
+    is a transpose of the last two dimensions, used only by that matmul. Such
+    pairs are replaced by a single matmul_t operation, which transposes the
+    operand as a view, so the transposed tensor is never stored on a node.
+    
+    Example:
+        Input graph:
+            a → matmul → output
+                  ↑
+            b → transpose
+            
+        After optimization:
+            a → matmul_t → output
+                  ↑
+                  b
+    '''
+    
+    changed = False  # Whether any rewrite was made
+    
+    for matmul_node in list(graph.nodes_by_op.get('matmul', {})):
+        if len(matmul_node.inputs) != 2:
+            continue
+        
+        input_a, transpose_node = matmul_node.inputs
+        
+        # The transpose can only go away if this matmul is its only consumer
+        if len(transpose_node.outputs) != 1 or transpose_node is input_a or graph.is_output(transpose_node):
+            continue
+        if not is_last_dims_transpose(transpose_node):
+            continue
+        
+        input_b = transpose_node.inputs[0]
+        
+        # Create the fused node in place of the matmul
+        fused_node = Node(name=f"matmul_t_{matmul_node.id}", kind=MatmulT("matmul_t", OperationType.BINARY))
+        graph.add_node(fused_node)
+        graph.connect(input_a, fused_node)
+        graph.connect(input_b, fused_node)
+        
+        # Replace the matmul with the fused node, which also removes the
+        # transpose, as the matmul was its only consumer
+        graph.replace_node(matmul_node, fused_node)
+        
+        changed = True
+    
+    return graph, changed
@@ -0,0 +1,46 @@
+from typing import Optional, Tuple
+from ..graph import Graph, Node
+from .cancel_transpose import transpose_dims
+
+
+def identity_view_rule(graph: Graph, transpose_node: Node) -> Optional[Node]:
+    """Peephole rule replacing a transpose that swaps a dimension with itself by its input."""
+    # A transpose is the identity if both dimensions normalize to the same one
+    if len(transpose_dims(transpose_node)) != 1:
+        return None
+    return transpose_node.inputs[0]
+
+
+def identity_view_elimination(graph: Graph) -> Tuple[Graph, bool]:
+    '''
+    Removes view operations that leave their input unchanged.
+
+    This optimization pass looks for transpose operations that swap a
+    dimension with itself (for example dim0=1, dim1=-1 on a 2-D input).
+    Such a transpose returns its input as is, so it is removed and its
+    consumers read the input directly.
+
+    Example:
+        Input graph:
+            input → transpose(1, -1) → output
+
+        After optimization:
+            input → output
+    '''
+
+    changed = False  # Whether any rewrite was made
+
+    with graph.batch():
+        for transpose_node in list(graph.nodes_by_op.get('transpose', {})):
+            # A transpose is the identity if both dimensions normalize to the same one
+            if len(transpose_dims(transpose_node)) != 1:
+                continue
+
+            original_input = transpose_node.inputs[0]
+
+            # Redirect all outputs of the transpose to its input and remove it
+            graph.replace_node(transpose_node, original_input)
+
+            changed = True
+
+    return graph, changed
\ No newline at end of file
@@ -1,42 +1,93 @@
 import torch
-from ..graph import Graph, Node, Data, DataType
+from typing import Optional, Tuple
+from weakref import WeakKeyDictionary
+from ..graph import Graph, Node, Data, DataType, DataOrigin
+from .peephole import peephole
 
 
 
+# Results of is_one_tensor, constants don't change, so each tensor is only scanned once
+_is_one_cache: 'WeakKeyDictionary[Node, bool]' = WeakKeyDictionary()
+
+
+@torch.inference_mode()
 def is_one_tensor(node: Node) -> bool:
-    """Check if a node represents an identity matrix or a tensor of all ones."""
+    """Check if a node represents an identity matrix or a batch of them."""
     if not isinstance(node.kind, Data) or node.kind.type != DataType.CONSTANT:
         return False
     
+    # Tensors known to be identity matrices or ones don't have to be scanned.
+    # Tensors of ones are only identity matrices if their matrices are 1x1
+    if node.kind.origin == DataOrigin.EYE:
+        value = node.kind.value
+        return value.numel() > 0 and value.dim() >= 2 and value.shape[-1] == value.shape[-2]
+    if node.kind.origin == DataOrigin.ONES:
+        value = node.kind.value
+        return value.numel() > 0 and value.dim() >= 2 and tuple(value.shape[-2:]) == (1, 1)
+    
+    cached = _is_one_cache.get(node)
+    if cached is not None:
+        return cached
+    
     tensor = node.get_tensor()
     if tensor is None:
         return False
     
-    # For scalar case
-    if tensor.dim() == 0:
-        return tensor.item() == 1
+    result = _is_one(tensor)
+    _is_one_cache[node] = result
+    return result
+
+
+def _is_one(tensor: torch.Tensor) -> bool:
+    """Check if a tensor is an identity matrix, or a stack of them in its last two dimensions."""
+    # Empty tensors are never treated as identities. Scalars can't be multiplied
+    # with matmul, and matmul always removes a vector's dimension from the result,
+    # so neither is ever an identity
+    if tensor.numel() == 0 or tensor.dim() < 2:
+        return False
     
-    # For vector case (all ones)
-    if tensor.dim() == 1:
-        return bool(torch.all(tensor == 1).item())
+    # Check if every matrix in the last two dimensions is an identity matrix.
+    # Higher dimensions hold batches of matrices, so a tensor of all ones is
+    # not an identity there either
+    n = tensor.shape[-1]
+    if tensor.shape[-2] != n:
+        # Non-square matrices can't be identity matrices
+        return False
     
-    # For matrix case, check if it's an identity matrix
-    if tensor.dim() == 2:
-        # Check if matrix is square
-        if tensor.shape[0] != tensor.shape[1]:
-            # Non-square matrices can't be identity matrices
-            return False
-            
-        # Use torch.eye to create an identity matrix and compare
-        # This is a much cleaner approach than the previous implementation
-        identity = torch.eye(tensor.shape[0])
-        return torch.equal(tensor, identity)
+    # An identity matrix has ones on the diagonal. Checking the diagonal
+    # elements first rejects most other matrices without a full scan
+    if not _is_all_ones(torch.diagonal(tensor, dim1=-2, dim2=-1)):
+        return False
     
-    # For higher dimensions, check element-wise
-    return bool(torch.all(tensor == 1).item())
+    # With a diagonal of ones, exactly n non-zero elements per matrix means
+    # all off-diagonal elements are zero
+    return torch.count_nonzero(tensor).item() == tensor.numel() // n
+
 
+def _is_all_ones(tensor: torch.Tensor) -> bool:
+    """Check if all elements of a non-empty tensor are one, without building a boolean tensor."""
+    min_value, max_value = torch.aminmax(tensor)
+    return min_value.item() == 1 and max_value.item() == 1
 
-def matmul_identity(graph: Graph) -> Graph:
+
+def matmul_identity_rule(graph: Graph, matmul_node: Node) -> Optional[Node]:
+    """Peephole rule replacing a matrix multiplication with an identity matrix by its other operand."""
+    # Check if operation is binary (has exactly 2 inputs)
+    if len(matmul_node.inputs) != 2:
+        return None
+    
+    # Keep the other operand of an identity input. The identity can broadcast
+    # the other operand to a bigger shape, so it only replaces the matrix
+    # multiplication if the shapes match
+    for i, input_node in enumerate(matmul_node.inputs):
+        other_input = matmul_node.inputs[1 - i]
+        if is_one_tensor(input_node) and other_input.get_shape() == matmul_node.get_shape():
+            return other_input
+    
+    return None
+
+
+def matmul_identity(graph: Graph) -> Tuple[Graph, bool]:
     '''
     Removes unnecessary matrix multiplications with identity matrices.
     
@@ -54,99 +105,4 @@ def matmul_identity(graph: Graph) -> Graph:
             input → output
     '''
 
-    # Continue optimizing until no more changes can be made
-    changes_made = True
-    while changes_made:
-        changes_made = False
-        
-        # Get all matmul operations
-        matmul_ops = []
-        if "matmul" in graph.nodes_by_name:
-            matmul_ops.extend(graph.nodes_by_name["matmul"].copy())
-        
-        if not matmul_ops:
-            break  # No matmul operations to optimize
-        
-        for matmul_node in matmul_ops:
-            
-            # Check if any of the inputs are identity matrices
-            identity_inputs = []
-            non_identity_inputs = []
-            
-            for i, input_node in enumerate(matmul_node.inputs):
-                if is_one_tensor(input_node):
-                    identity_inputs.append((i, input_node))
-                else:
-                    non_identity_inputs.append((i, input_node))
-            
-            # If at least one input is an identity matrix, we can optimize
-            if identity_inputs:
-                # Determine which node to keep
-                # If we have non-identity inputs, use the first one
-                # Otherwise, use the first identity input
-                if non_identity_inputs:
-                    _, node_to_keep = non_identity_inputs[0]
-                else:
-                    # If both are identity matrices, just pick the first one
-                    _, node_to_keep = identity_inputs[0]
-                    
-                    # IMPORTANT: Check if the shapes are compatible for removal
-                    # We can only remove the matmul node if the shape of the output
-                    # would be the same as the shape of the non-identity input
-
-                    # If the shapes wouldn't match, skip this optimization
-                    if node_to_keep.get_shape() != matmul_node.get_shape():
-                        continue
-                
-                # Collect nodes to potentially remove (all inputs except the one we're keeping)
-                nodes_to_remove = []
-                for input_node in matmul_node.inputs:
-                    if input_node != node_to_keep:
-                        nodes_to_remove.append(input_node)
-                
-                # Check if matmul_node was an output node
-                was_output = matmul_node in graph.output_nodes
-                
-                # Redirect all outputs of the matmul node to use the node we're keeping
-                for output_node in matmul_node.outputs.copy():
-                    matmul_node.outputs.remove(output_node)
-                    output_node.inputs.remove(matmul_node)
-                    graph.connect(node_to_keep, output_node)
-                
-                # If the matmul node was an output, mark the kept node as output too
-                if was_output and node_to_keep not in graph.output_nodes:
-                    graph.output_nodes.append(node_to_keep)
-                
-                # Remove matmul node from graph and output_nodes if needed
-                if matmul_node in graph.output_nodes:
-                    graph.output_nodes.remove(matmul_node)
-                graph.nodes.remove(matmul_node)
-                
-                # Remove from nodes_by_name
-                if "matmul" in graph.nodes_by_name and matmul_node in graph.nodes_by_name["matmul"]:
-                    graph.nodes_by_name["matmul"].remove(matmul_node)
-                    if not graph.nodes_by_name["matmul"]:
-                        del graph.nodes_by_name["matmul"]
-                
-                # Remove identity inputs if they're not used by any other node
-                for node in nodes_to_remove:
-                    # First remove matmul_node from outputs
-                    if matmul_node in node.outputs:
-                        node.outputs.remove(matmul_node)
-                    if not node.outputs:
-                        if node in graph.nodes:
-                            graph.nodes.remove(node)
-                        
-                        # Remove from nodes_by_name
-                        base_name = node.name.rsplit('_', 1)[0]
-                        if base_name in graph.nodes_by_name and node in graph.nodes_by_name[base_name]:
-                            graph.nodes_by_name[base_name].remove(node)
-                            if not graph.nodes_by_name[base_name]:
-                                del graph.nodes_by_name[base_name]
-                
-                # Mark that we made a change and break to restart with fresh node lists
-                changes_made = True
-                break
-
-    # No need to recalculate output nodes since we maintain them during optimization
-    return graph
\ No newline at end of file
+    return peephole(graph, [("matmul", matmul_identity_rule)])
\ No newline at end of file
@@ -0,0 +1,83 @@
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from ..graph import Graph, Node, Operation
+from .worklist import Worklist
+
+# A rewrite rule: the operation name it applies to (None for any operation)
+# and a function returning the node that should replace a matching node,
+# or None if the rule doesn't apply
+Rule = Tuple[Optional[str], Callable[[Graph, Node], Optional[Node]]]
+
+
+def peephole(graph: Graph, rules: List[Rule], nodes: Optional[Iterable[Node]] = None) -> Tuple[Graph, bool]:
+    '''
+    Applies local rewrite rules until none of them matches anymore.
+
+    Every operation is checked against the rules for its operation name and
+    the rules for any operation, in the order they appear in rules. When a rule returns a
+    replacement, the operation is replaced with it, inputs that are no longer
+    used are removed, and the consumers are checked again, as their inputs
+    changed. All rules are applied in the same walk over the graph, which
+    visits operations in topological order, so a whole chain of rewrites
+    (e.g. folding a chain of constant operations) settles in a single walk.
+    Callers that know which nodes can match can pass them as nodes, so the
+    walk starts from those instead of every operation.
+
+    Example:
+        Input graph, with the rule ("add", x + 0 → x):
+            input → add → output
+                     ↑
+                   zeros
+
+        After optimization:
+            input → output
+    '''
+
+    changed = False  # Whether any rewrite was made
+
+    # Rules matching each operation name, in the order they were given,
+    # built the first time an operation with that name is checked
+    rules_by_op: Dict[str, List[Callable[[Graph, Node], Optional[Node]]]] = {}
+
+    def rules_for(node: Node) -> List[Callable[[Graph, Node], Optional[Node]]]:
+        if not isinstance(node.kind, Operation):
+            return []
+        name = node.kind.name
+        if name not in rules_by_op:
+            rules_by_op[name] = [match for op_name, match in rules if op_name is None or op_name == name]
+        return rules_by_op[name]
+
+    # Inputs are visited before their consumers. Nodes outside the topological
+    # order (not needed for any output) come last, the worklist skips repeats
+    if nodes is None:
+        nodes = chain(graph.topological_sort(), graph.nodes)
+    worklist = Worklist(node for node in nodes if rules_for(node))
+
+    with graph.batch():
+        while worklist:
+            node = worklist.pop()
+
+            # Skip nodes removed by an earlier rewrite
+            if node not in graph.nodes:
+                continue
+
+            # Use the replacement of the first matching rule
+            for match in rules_for(node):
+                replacement = match(graph, node)
+                if replacement is not None:
+                    break
+            else:
+                continue
+
+            # replace_node gives the node a new consumer set, so this one stays intact
+            consumers = node.outputs
+            graph.replace_node(node, replacement)
+
+            # Only consumers, whose inputs changed, can match a rule they didn't match before
+            for output_node in consumers:
+                if rules_for(output_node):
+                    worklist.push(output_node)
+
+            changed = True
+
+    return graph, changed
\ No newline at end of file
@@ -0,0 +1,37 @@
+from collections import deque
+from typing import Deque, Iterable, Set
+from ..graph import Node
+
+
+class Worklist:
+    '''
+    Queue of nodes a pass still has to visit.
+
+    A node is queued at most once at a time, so passes can push the
+    neighbours of every rewrite without checking for duplicates. Passes
+    seed it with their candidate nodes and, after a rewrite, only push the
+    nodes whose inputs changed, instead of rescanning the whole graph.
+    '''
+    def __init__(self, nodes: Iterable[Node] = ()):
+        self._queue: Deque[Node] = deque()
+        self._in_queue: Set[Node] = set()
+        for node in nodes:
+            self.push(node)
+
+    def push(self, node: Node) -> None:
+        """Queue a node, unless it is already queued"""
+        if node not in self._in_queue:
+            self._in_queue.add(node)
+            self._queue.append(node)
+
+    def pop(self) -> Node:
+        """Take the node that was queued first"""
+        node = self._queue.popleft()
+        self._in_queue.discard(node)
+        return node
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def __bool__(self) -> bool:
+        return bool(self._queue)
\ No newline at end of file
@@ -1,8 +1,27 @@
-import json
-from typing import Dict, Any, Union
+from typing import Dict, Any, List, Union
+import numpy as np
 import torch
 
-from ..graph import Graph, Node, Data, Operation, DataType
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library parser is used without it
+    orjson = None
+
+
+def json_loads(data: bytes) -> Any:
+    """Parse JSON with orjson if available, falling back to the standard library parser"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN, Infinity and numbers overflowing a double,
+            # which the standard library parser accepts (and json.dump writes)
+            pass
+    return json.loads(data)
+
+from ..graph import Graph, Node, Data, Operation, DataType, DataOrigin
 from ..ops import op_map
 
 
@@ -19,15 +38,60 @@ def create_operation(op_config: Dict[str, Any]) -> Operation:
     return op_class(name=op_name, op_type=op_type, args=args)
 
 
+def matches_origin(array: np.ndarray, origin: DataOrigin) -> bool:
+    """Check if an array holds what its origin says it holds"""
+    if origin == DataOrigin.ZEROS:
+        return not array.any()
+    if origin == DataOrigin.ONES:
+        return bool((array == 1).all())
+    if origin == DataOrigin.EYE:
+        # Identity matrices, or a stack of them in the last two dimensions
+        return (array.ndim >= 2 and array.shape[-1] == array.shape[-2]
+                and np.array_equal(array, np.broadcast_to(np.eye(array.shape[-1]), array.shape)))
+    return True
+
+
+def create_origin_array(origin: DataOrigin, shape: List[int], dtype: Any) -> np.ndarray:
+    """Create the array described by an origin, for data given by shape instead of value"""
+    if origin == DataOrigin.ZEROS:
+        return np.zeros(shape, dtype=dtype)
+    if origin == DataOrigin.ONES:
+        return np.ones(shape, dtype=dtype)
+    if origin == DataOrigin.EYE:
+        if len(shape) < 2 or shape[-1] != shape[-2]:
+            raise ValueError(f"Identity data needs square matrices in its last two dimensions, got shape {shape}")
+        return np.broadcast_to(np.eye(shape[-1], dtype=dtype), shape).copy()
+    raise ValueError(f"Data with origin {origin.name} must have a value")
+
+
 def create_data(data_config: Dict[str, Any]) -> Data:
     """Create Data instance based on data configuration"""
     type = DataType[data_config["type"]]
+    
+    # Optional, what the producer knows about the contents: ZEROS, ONES, EYE or OTHER
+    origin_name = data_config.get("origin", DataOrigin.OTHER.name)
+    if origin_name not in DataOrigin.__members__:
+        raise ValueError(f"Unknown data origin: {origin_name}")
+    origin = DataOrigin[origin_name]
 
     if "value" in data_config:
-        # Convert list to tensor
-        return Data(type=type, value=torch.tensor(data_config["value"]))
+        # Convert list to tensor, NumPy converts nested lists much faster than torch.tensor
+        array = np.asarray(data_config["value"], dtype=data_config.get("dtype"))
+        
+        # Passes trust the origin instead of checking the tensor, so it is checked here once
+        if not matches_origin(array, origin):
+            raise ValueError(f"Data value doesn't match its origin {origin.name}")
+    elif "shape" in data_config and origin != DataOrigin.OTHER:
+        # Zeros, ones and identity matrices can be given by their shape alone
+        array = create_origin_array(origin, data_config["shape"], data_config.get("dtype"))
     else:
         raise ValueError("Data node must have a value")
+    
+    # Without an explicit dtype, floats default to float32, like with torch.tensor
+    if "dtype" not in data_config and array.dtype == np.float64:
+        array = array.astype(np.float32)
+    
+    return Data(type=type, value=torch.from_numpy(array), origin=origin)
 
 
 def create_node(node_config: Dict[str, Any], input_values: Dict[str, torch.Tensor] = {}) -> Node:
@@ -65,10 +129,9 @@ def load_config(config_path: str, input_sample: Union[torch.Tensor, Dict[str, to
         input_values = input_sample
         
     # Read configuration file
-    with open(config_path, 'r') as f:
-        config = json.load(f)
+    with open(config_path, 'rb') as f:
+        config = json_loads(f.read())
         
-    # First pass: Create all nodes
     nodes_map: Dict[str, Node] = {}
     
     # Create all explicit input nodes with their values
@@ -79,29 +142,34 @@ def load_config(config_path: str, input_sample: Union[torch.Tensor, Dict[str, to
                 kind=Data(type=DataType.INPUT, value=value)
             )
             nodes_map[name] = input_node
-            graph.add_node(input_node)
-            graph.input_nodes.append(input_node)
-            
-    # Then create all nodes from config
+            graph.add_input_node(input_node)
+    
+    config_by_name: Dict[str, Dict[str, Any]] = {}
     for node_config in config:
-        if node_config["name"] not in nodes_map:  # Skip if already created
-            node = create_node(node_config, input_values)
-            nodes_map[node_config["name"]] = node
+        config_by_name.setdefault(node_config["name"], node_config)
+    
+    def get_or_create(name: str) -> Node:
+        """Get a node by name, creating it from its configuration on first use"""
+        node = nodes_map.get(name)
+        if node is None:
+            node = create_node(config_by_name[name], input_values)
+            nodes_map[name] = node
             graph.add_node(node)
-            if node_config["is_output"]:
-                graph.output_nodes.append(node)
+        return node
             
-            
-    # Second pass: Connect nodes
+    # Create and connect nodes in a single pass, inputs are created when first referenced
     for node_config in config:
-        node = nodes_map[node_config["name"]]
+        node = get_or_create(node_config["name"])
+        
+        # Outputs are marked in config order, even if the node was created earlier as an input of another node
+        if node_config["is_output"] and node_config["name"] not in input_values:
+            graph.add_output_node(node)
         
         # Connect inputs
         for input_name in node_config["inputs"]:
-            if input_name not in nodes_map:
+            if input_name not in nodes_map and input_name not in config_by_name:
                 raise ValueError(f"Input node {input_name} not found for node {node.name}")
-            input_node = nodes_map[input_name]
-            graph.connect(input_node, node)
+            graph.connect(get_or_create(input_name), node)
             
     # Validate that all input nodes have values
     for input_node in graph.input_nodes: